@@ -1,57 +1,158 @@
 import argparse
 import logging
+import os
 import sys
+import time
+from functools import partial
 
 import utility
+from connections import ConnectionManager
 from drum_sequencer import DrumSequencer
+from health import HealthMonitor
 from ipc import IpcServer
+from journal import EventJournal, JournalReplay, prune_journals
+from loop_scheduler import QuantizedScheduler
 from looper import Looper
 from menu import Menu
-from menu_handlers import BaseMenuHandler, MidiExpanderHandler, PresetsHandler, LooperHandler, RecordHandler, DrumsHandler, UtilitiesHandler, SystemHandler
+from menu_handlers import BaseMenuHandler, MidiExpanderHandler, PresetsHandler, LooperHandler, RecordHandler, DrumsHandler, SetlistHandler, UtilitiesHandler, SystemHandler
 from midi_receiver import MidiReceiver, MidiMapping
+from midi_watcher import MidiDeviceWatcher
 from osc_server import OscServer
 from recorder import Recorder
+from setlist import Setlist, SONGS
 from ui_tk import TkUi
 
 
 class App:
-    def __init__(self):
+    # Looper commands which are held back until the next boundary when quantizing. Commands which
+    # (may) resume playback ('pause', 'pause_off') are never quantized, a paused loop has no boundary.
+    QUANTIZED_LOOPER_COMMANDS = {'mute', 'mute_on', 'mute_off', 'trigger', 'pause_on'}
+
+    def __init__(self, log_buffer=None):
+        self._log_buffer = log_buffer  # RingBufferHandler with recent log records for the Utilities menu
         self.ipc = IpcServer()  # Start IPC to webserver (server-side): mandatory but there might not be a client connecting to it
+        self.connections = ConnectionManager()  # Keeps JACK/ALSA connections in line with the desired routing
         self.osc = OscServer()  # Start app OSC server: mandatory but there might not be a client connecting to it
         self.looper = Looper()  # Start sooperlooper: optional (disable with --no-looper)
+        self.scheduler = QuantizedScheduler()  # Executes quantized looper/preset events on loop boundaries
         self.recorder = Recorder()  # Init audio recorder: always on but no background activity
         self.drum_sequencer = DrumSequencer()  # Init audio/drums player: always on but no background activity
+        self.health = None  # System health monitor, started in main()
+
+        self.journal = None  # Event journal, opened in main() unless disabled with --no-journal
+        self._replay = None  # JournalReplay started with --replay
 
-        # Only start MIDI receiver thread if USBMIDI device (foot pedal) is connected
+        # Only start MIDI receiver thread if USBMIDI device (foot pedal) is connected, attached/detached on hot-plug
         self.midi_receiver = MidiReceiver('USBMIDI', self) if utility.check_midi(['USBMIDI']) else None
+        self.midi_watcher = MidiDeviceWatcher()
+        self.midi_watcher.add_callback(self._midi_device_changed)
+        self.midi_watcher.add_changes_callback(self._midi_devices_changed)
 
         self._handlers = {}
 
+    def _midi_device_changed(self, name, present):
+        if 'USBMIDI' in name:  # same substring match as check_midi() and the MIDI handlers
+            if present and self.midi_receiver is None:
+                try:
+                    self.midi_receiver = MidiReceiver('USBMIDI', self)
+                except ValueError as e:
+                    logging.warning(e)
+                else:
+                    # Keep the receiver disabled while MIDI passthru is active
+                    self.midi_receiver.enabled = not self.connections.has_graph('midi-passthru')
+            elif not present and self.midi_receiver is not None:
+                self.midi_receiver.close()
+                self.midi_receiver = None
+
+        for handler in self._handlers.values():
+            handler.midi_device_changed(name, present)
+
+    def _midi_devices_changed(self, added, removed):
+        # Restore routing straight away, once per poll and only if a routed client came or went
+        if any(self.connections.routes_midi_client(name) for name in added | removed):
+            self.connections.apply()
+
     def quit(self):
         logging.info('Exiting')
 
         if self.looper and self.looper.is_running:
             self.looper.stop()
 
+        self.scheduler.stop()
+        self.health.stop()
+        self.drum_sequencer.close()
+
+        # Stop everything that writes to the journal before closing its mapping
+        self.midi_watcher.stop()  # no receiver gets reattached from here on
+        if self.midi_receiver:
+            self.midi_receiver.close()
+        if self._replay:
+            self._replay.stop()
+        if self.journal:
+            journal, self.journal = self.journal, None
+            journal.close()
+
+        self.connections.stop()
+        self.osc.stop()
         self.ipc.stop()
 
         sys.exit(0)
 
+    def _is_quantized(self, event_target, event_payload):
+        if self.args.quantize == 'off':
+            return False
+        if event_target == MidiMapping.EVENT_TARGET_PRESET:
+            return True
+        if event_target == MidiMapping.EVENT_TARGET_LOOPER:
+            commands = [event_payload] if isinstance(event_payload, str) else [cmd for _, cmd in event_payload]
+            return all(cmd in self.QUANTIZED_LOOPER_COMMANDS for cmd in commands)
+        return False
+
     def send_event(self, event_target, event_payload):
-        logging.debug('Event: {} {}'.format(event_target, event_payload))
+        journal = self.journal  # read once, quit() may detach it concurrently
+        if journal:
+            journal.record_event(event_target, event_payload)
+        logging.debug('Event: %s %s', event_target, event_payload)
+        if self._is_quantized(event_target, event_payload):
+            self.scheduler.schedule(partial(self._dispatch_event, event_target, event_payload), self.args.quantize)
+        else:
+            self._dispatch_event(event_target, event_payload)
+
+    def _dispatch_event(self, event_target, event_payload):
         if event_target == MidiMapping.EVENT_TARGET_PRESET:
             self._handlers['presets'].trigger_preset(event_payload)
         elif event_target == MidiMapping.EVENT_TARGET_MIDI_LOOP:
             self._handlers['midi'].toggle(event_payload)
         elif event_target == MidiMapping.EVENT_TARGET_LOOPER:
-            self._handlers['looper'].send_osc(event_payload)
+            # A single command for the first loop or a list of (loop, cmd) sent as one bundle
+            if isinstance(event_payload, str):
+                self._handlers['looper'].send_osc(event_payload)
+            else:
+                self._handlers['looper'].send_bundle(event_payload)
         elif event_target == MidiMapping.EVENT_TARGET_DRUMS:
             self._handlers['drums'].play_song()
+        elif event_target == MidiMapping.EVENT_TARGET_SETLIST:
+            # 'next' advances, a number jumps to that song
+            if event_payload == 'next':
+                self._handlers['setlist'].next_song()
+            else:
+                self._handlers['setlist'].goto_song(event_payload)
+        elif event_target == MidiMapping.EVENT_TARGET_ALERT:
+            self._handlers['system'].show_alert(event_payload)
 
     def _parse_arguments(self):
         parser = argparse.ArgumentParser()
         parser.add_argument('-v', help='verbose', action='store_true', default=False)
         parser.add_argument('--no-looper', help='don\'t start looper', action='store_true', default=False)
+        parser.add_argument('--loops', help='number of sooperlooper loops', type=int, default=1)
+        parser.add_argument('--quantize', help='delay mute/trigger/preset events to the next loop or cycle boundary',
+                            choices=['off', QuantizedScheduler.QUANTIZE_LOOP, QuantizedScheduler.QUANTIZE_CYCLE], default='off')
+        parser.add_argument('--health-interval', help='system health sample interval in seconds', type=float, default=2.0)
+        parser.add_argument('--journal', help='event journal file', default=time.strftime('journals/journal-%Y%m%d-%H%M%S.bin'))
+        parser.add_argument('--no-journal', help='don\'t record events', action='store_true', default=False)
+        parser.add_argument('--keep-journals', help='number of journals kept in the journal\'s directory', type=int, default=10)
+        parser.add_argument('--replay', help='replay the events of a journal file after startup', metavar='JOURNAL')
+        parser.add_argument('--replay-speed', help='replay speed factor (0: as fast as possible)', type=float, default=1.0)
         return parser.parse_args()
 
     def main(self):
@@ -59,6 +160,11 @@ class App:
         self.args = self._parse_arguments()
         logging.debug(self.args)
 
+        if not self.args.no_journal:
+            # Make room for the new journal, but keep the one being replayed
+            prune_journals(os.path.dirname(self.args.journal) or '.', self.args.keep_journals - 1, exclude=[self.args.replay] if self.args.replay else ())
+            self.journal = EventJournal(self.args.journal)
+
         # System checks
         assert utility.check_sound_card('card 0:'), 'No ALSA device found'
         # assert check_sound_card('card 1:'), 'USB DAC not found'
@@ -69,24 +175,51 @@ class App:
         Menu.ui = TkUi(fullscreen=True, fontsize=56)
 
         self.ipc.start()
+        self.osc.start()
 
+        self.looper.loops = self.args.loops
         if not self.args.no_looper:
             self.looper.start()
+            self.connections.set_graph('looper', self.looper.connection_graph)
+            if self.args.quantize != 'off':
+                # Position updates arrive every 10 ms, only ask for them when they are needed
+                self.scheduler.subscribe(self.looper.osc_interface)
+        self.scheduler.start()
+        self.connections.start()
 
         main_menu = Menu('main')
-        submenus = {name: Menu(name, main_menu) for name in ['midi', 'presets', 'looper', 'record', 'drums', 'utilities', 'system']}
+        submenus = {name: Menu(name, main_menu) for name in ['midi', 'presets', 'looper', 'record', 'drums', 'setlist', 'utilities', 'system']}
 
         # Create main menu
         BaseMenuHandler.app = self
         self._handlers['midi'] = MidiExpanderHandler(submenus['midi'])
         self._handlers['presets'] = PresetsHandler(submenus['presets'])
-        self._handlers['looper'] = LooperHandler(submenus['looper'])
+        self._handlers['looper'] = LooperHandler(submenus['looper'], self.looper)
         self._handlers['record'] = RecordHandler(submenus['record'])
         self._handlers['drums'] = DrumsHandler(submenus['drums'], self.drum_sequencer)
-        self._handlers['utilities'] = UtilitiesHandler(submenus['utilities'])
+        self.setlist = Setlist(SONGS, self.drum_sequencer, self._handlers['presets'], self._handlers['looper'])
+        self._handlers['setlist'] = SetlistHandler(submenus['setlist'], self.setlist)
+        self._handlers['utilities'] = UtilitiesHandler(submenus['utilities'], self._log_buffer)
         self._handlers['system'] = SystemHandler(submenus['system'])
 
         self._handlers['record'].recorder = self.recorder
 
+        # Prefetch the first song of the setlist
+        self.setlist.prepare_next()
+
+        self.midi_watcher.start()
+
+        # System health: status in the System menu and via IPC/OSC, alerts as events
+        self.health = HealthMonitor(self.args.health_interval)
+        self.health.add_callback(self._handlers['system'].update_health)
+        self.health.add_alert_callback(partial(self.send_event, MidiMapping.EVENT_TARGET_ALERT))
+        self.health.add_cleared_callback(self._handlers['system'].clear_alert)
+        self.ipc.health_status = self.osc.health_status = self.health.status
+        self.health.start()
+
+        if self.args.replay:
+            self._replay = JournalReplay(self, self.args.replay, self.args.replay_speed)
+            self._replay.start()
+
         main_menu.make_ui()
         Menu.ui.mainloop()
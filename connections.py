@@ -0,0 +1,187 @@
+import logging
+import subprocess
+import threading
+
+import utility
+
+
+def _split_client_spec(spec):
+    """'USBMIDI:1' -> ('USBMIDI', '1'), a spec without a port number means port 0"""
+    name, _, port = spec.rpartition(':')
+    return (name, port) if name and port.isdigit() else (spec, '0')
+
+
+class ConnectionGraph:
+    """
+    Desired audio and MIDI routing as data.
+
+    Audio edges are (output, input) JACK port names, e.g. ('system:capture_1', 'system:playback_1').
+    MIDI edges are (sender, receiver) ALSA sequencer clients given by client name, optionally
+    with a port number, e.g. ('USBMIDI', 'sooperlooper') or ('USBMIDI:0', 'CH345:0').
+    """
+    def __init__(self, audio=(), midi=()):
+        self.audio = frozenset(audio)
+        self.midi = frozenset(midi)
+
+    def __or__(self, other):
+        return ConnectionGraph(self.audio | other.audio, self.midi | other.midi)
+
+    def __repr__(self):
+        return 'ConnectionGraph(audio={}, midi={})'.format(sorted(self.audio), sorted(self.midi))
+
+
+class ConnectionManager:
+    """
+    Keeps the JACK and ALSA connection graphs in line with the desired routing.
+
+    Routing is held as named layers (e.g. 'looper', 'audio-passthru') which are merged
+    into one desired graph. Applying reads the actual graph with a single query per
+    subsystem and only connects the missing and disconnects the extra edges.
+
+    Applying is event driven: setting a layer applies, and the app applies when a MIDI
+    device comes or goes. Edges whose ports don't exist (yet) are skipped, and only while
+    some are waiting is the graph re-checked every retry_interval seconds: each jack_lsp
+    run registers a JACK client, which risks xruns.
+    """
+    def __init__(self, retry_interval=30.0):
+        self._log = logging.getLogger(__name__)
+        self._layers = {}
+        self._managed_audio = set()  # JACK ports that appeared in any layer
+        self._managed_midi = set()  # ALSA client specs that appeared in any layer
+        self._lock = threading.RLock()
+        self._midi_flushed = False  # MIDI routing suspended by flush_midi()
+        self._pending = False  # desired edges waiting for their ports to appear
+        self._retry_interval = retry_interval
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run_resync)
+
+    @property
+    def desired(self):
+        graph = ConnectionGraph()
+        for layer in self._layers.values():
+            graph = graph | layer
+        return graph
+
+    def has_graph(self, name):
+        return name in self._layers
+
+    def routes_midi_client(self, name):
+        """Whether any layer connects the ALSA client, i.e. routing changes when it comes or goes"""
+        with self._lock:
+            return any(_split_client_spec(spec)[0] == name for spec in self._managed_midi)
+
+    def set_graph(self, name, graph):
+        """Swap the named layer for the given graph (None removes the layer) and apply"""
+        with self._lock:
+            if graph is None:
+                self._layers.pop(name, None)
+            else:
+                self._layers[name] = graph
+                if graph.midi:
+                    self._midi_flushed = False
+                self._managed_audio.update(port for edge in graph.audio for port in edge)
+                self._managed_midi.update(client for edge in graph.midi for client in edge)
+            self._log.info('Routing layers: {}'.format(', '.join(sorted(self._layers)) or 'none'))
+            self.apply()
+
+    @property
+    def midi_flushed(self):
+        return self._midi_flushed
+
+    def flush_midi(self):
+        """
+        Disconnect every ALSA connection and suspend MIDI routing until restore_midi().
+
+        The midi-passthru layer is dropped, the MIDI edges of the other layers (e.g. looper)
+        are kept and come back with restore_midi() or when a layer with MIDI edges is set.
+        """
+        with self._lock:
+            self._layers.pop('midi-passthru', None)
+            self._midi_flushed = True
+            self._call(['aconnect', '-x'])
+
+    def restore_midi(self):
+        with self._lock:
+            self._midi_flushed = False
+            self.apply()
+
+    def apply(self):
+        """Bring the actual graphs in line with the desired graph"""
+        with self._lock:
+            desired = self.desired
+            pending = self._apply_audio(desired.audio)
+            if not self._midi_flushed:
+                pending += self._apply_midi(desired.midi)
+            self._pending = pending > 0
+
+    def _apply_audio(self, desired):
+        """Returns the number of edges which couldn't be applied (yet)"""
+        try:
+            ports, edges = utility.parse_jack_lsp(subprocess.check_output(['jack_lsp', '-c', '-p']).decode())
+        except (OSError, subprocess.CalledProcessError) as e:
+            self._log.warning('Could not query JACK graph: {}'.format(e))
+            return len(desired)
+
+        extra = [e for e in edges - desired if e[0] in self._managed_audio and e[1] in self._managed_audio]
+        missing = [e for e in desired - edges if e[0] in ports and e[1] in ports]
+        for src, dst in extra:
+            self._call(['jack_disconnect', src, dst])
+        for src, dst in missing:
+            self._call(['jack_connect', src, dst])
+
+        pending = len(desired - edges) - len(missing)
+        if pending:
+            self._log.debug('{} audio connection(s) waiting for ports to appear'.format(pending))
+        return pending
+
+    def _apply_midi(self, desired):
+        """Returns the number of edges which couldn't be applied (yet)"""
+        try:
+            clients, ports, edges = utility.read_seq_clients()
+        except OSError as e:
+            self._log.warning('Could not query ALSA sequencer graph: {}'.format(e))
+            return len(desired)
+
+        def resolve(spec):
+            name, port = _split_client_spec(spec)
+            for client_id, client_name in clients.items():
+                if client_name == name:
+                    address = '{}:{}'.format(client_id, port)
+                    return address if address in ports else None
+            return None
+
+        wanted, pending = set(), 0
+        for src, dst in desired:
+            edge = (resolve(src), resolve(dst))
+            if None in edge:
+                self._log.debug('MIDI connection {} -> {} waiting for clients to appear'.format(src, dst))
+                pending += 1
+            else:
+                wanted.add(edge)
+
+        managed = {resolve(spec) for spec in self._managed_midi} - {None}
+        for src, dst in edges - wanted:
+            if src in managed and dst in managed:
+                self._call(['aconnect', '-d', src, dst])
+        for src, dst in wanted - edges:
+            self._call(['aconnect', src, dst])
+        return pending
+
+    def _call(self, cmd):
+        self._log.info(' '.join(cmd))
+        try:
+            subprocess.check_call(cmd)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self._log.warning('{} failed: {}'.format(cmd[0], e))
+
+    def _run_resync(self):
+        while not self._stop_event.wait(self._retry_interval):
+            if self._pending:
+                self.apply()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
@@ -1,7 +1,15 @@
+import glob
 import logging
 import os.path
+import shutil
 import subprocess
+import tempfile
 import threading
+import wave
+
+
+# tmpfs so prefetched songs are read from memory instead of the SD card
+_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
 
 
 class DrumSequencer:
@@ -11,17 +19,106 @@ class DrumSequencer:
         self.songs = [('Kick', 'kick-180bpm.wav'), ('GnR', 'GnR-Paradise_City.wav'), ('FF', 'FF-Pretender.wav')]
         self.selection = 0
         self.running = False
+        self._player = None
+        self._player_file = None  # in-memory copy the player reads from, deleted when it stops
+        self._prefetched = None  # (selection, paused standby player, in-memory copy)
+        self._closed = False
+        self._lock = threading.Lock()
+
+        # Free copies left in memory by a previous run that didn't exit cleanly
+        for path in glob.glob(os.path.join(_MEMORY_DIR, 'pedalboard-*')):
+            os.remove(path)
+
+    def _load_to_memory(self, selection):
+        """Decodes the song into a PCM wav in memory (tmpfs), other formats are copied as they are"""
+        filename = self.songs[selection][1]
+        src = os.path.join(self._path, filename)
+        # Unique name so the playing copy of the same song isn't replaced or deleted
+        fd, dst = tempfile.mkstemp(prefix='pedalboard-', suffix='-' + filename, dir=_MEMORY_DIR)
+        os.close(fd)
+        try:
+            try:
+                with wave.open(src, 'rb') as w:
+                    params, frames = w.getparams(), w.readframes(w.getnframes())
+                with wave.open(dst, 'wb') as w:
+                    w.setparams(params)
+                    w.writeframes(frames)
+            except wave.Error:
+                shutil.copyfile(src, dst)
+        except Exception:
+            os.remove(dst)
+            raise
+        return dst
+
+    def prefetch(self, selection):
+        """Loads the song paused into a standby player so start() only has to unpause it"""
+        with self._lock:
+            if self._prefetched and self._prefetched[0] == selection:
+                return
+
+        # Loading and spawning the player take a while, start() and stop() mustn't wait for them
+        path = self._load_to_memory(selection)
+        try:
+            player = subprocess.Popen(['mplayer', '-slave', '-idle', '-quiet', '-ao', 'jack'],
+                                      stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            os.remove(path)
+            raise
+        self._command(player, 'pausing loadfile "{}"'.format(path))
 
-    def _run_player(self):
-        subprocess.call(['mplayer', '-ao', 'jack', os.path.join(self._path, self.songs[self.selection][1])])
+        with self._lock:
+            if self._closed:
+                stale = (selection, player, path)
+            else:
+                stale, self._prefetched = self._prefetched, (selection, player, path)
+        if stale:
+            self._end_player(*stale[1:])
+        self._log.info('Prefetched {}'.format(self.songs[selection][0]))
+
+    def _command(self, player, cmd):
+        player.stdin.write(cmd.encode() + b'\n')
+        player.stdin.flush()
+
+    def _end_player(self, player, path):
+        """Terminates the player and frees the memory of its song copy"""
+        player.terminate()
+        player.wait()
+        if path:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _discard_prefetched(self):
+        if self._prefetched:
+            self._end_player(*self._prefetched[1:])
+            self._prefetched = None
+
+    def _stop_player(self):
+        if self._player:
+            self._end_player(self._player, self._player_file)
+            self._player = self._player_file = None
 
     def start(self):
-        self._thread = threading.Thread(target=self._run_player)
-        self.running = True
-        self._thread.start()
-        self._log.info('drum sequencer thread has finished')
-        self.running = False
+        with self._lock:
+            self._stop_player()
+            if self._prefetched and self._prefetched[0] == self.selection:
+                _, self._player, self._player_file = self._prefetched
+                self._prefetched = None
+                self._command(self._player, 'pause')  # toggles pause, i.e. starts playback
+            else:
+                self._player = subprocess.Popen(['mplayer', '-ao', 'jack', os.path.join(self._path, self.songs[self.selection][1])],
+                                                stdin=subprocess.DEVNULL)
+            self.running = True
 
     def stop(self):
-        subprocess.call(['killall', 'mplayer'])
-        self._thread.join()
+        with self._lock:
+            self._stop_player()
+            self.running = False
+
+    def close(self):
+        """Stops playback and the standby player"""
+        self.stop()
+        with self._lock:
+            self._closed = True
+            self._discard_prefetched()
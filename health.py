@@ -0,0 +1,181 @@
+import collections
+import logging
+import threading
+import time
+
+
+Sample = collections.namedtuple('Sample', ['time', 'cpu', 'temperature', 'memory', 'xruns', 'throttled'])
+
+
+class _SysFile:
+    """A /proc or /sys file kept open and re-read from the start (no fork, no reopen)"""
+    def __init__(self, path):
+        try:
+            self._file = open(path, 'rb', buffering=0)
+        except OSError:
+            self._file = None
+
+    def read(self):
+        if self._file is None:
+            return None
+        self._file.seek(0)
+        return self._file.read(4096).decode()
+
+
+class HealthMonitor:
+    """
+    Samples CPU load, SoC temperature, memory use, throttling and JACK xruns in the background.
+
+    Values are read straight from /proc and /sys at a configurable interval into a fixed-size
+    time series. JACK has no procfs interface, so xruns are counted from jackd's output which
+    start.sh writes to jackd.log. Callbacks get cb(sample, status) after every sample and
+    alert callbacks get cb(message) when a threshold is crossed (once, until it clears).
+    Cleared callbacks get the same message when the value is back below the threshold.
+    """
+    THRESHOLDS = {
+        'cpu': 85.0,  # percent busy
+        'temperature': 75.0,  # degrees Celsius, the Pi starts throttling at 80
+        'memory': 90.0,  # percent used
+        'xruns': 0,  # xruns per interval
+    }
+
+    def __init__(self, interval=2.0, history=300, jackd_log='jackd.log', thresholds=None):
+        self._log = logging.getLogger(__name__)
+        self._interval = interval
+        self._thresholds = dict(self.THRESHOLDS, **(thresholds or {}))
+        self.samples = collections.deque(maxlen=history)
+        self._callbacks = []
+        self._alert_callbacks = []
+        self._cleared_callbacks = []
+        self._active_alerts = {}  # name -> message when the alert was raised
+
+        self._stat = _SysFile('/proc/stat')
+        self._meminfo = _SysFile('/proc/meminfo')
+        self._temperature = _SysFile('/sys/class/thermal/thermal_zone0/temp')
+        self._throttled = _SysFile('/sys/devices/platform/soc/soc:firmware/get_throttled')
+        self._cpu_times = None
+
+        self._jackd_log_path = jackd_log
+        self._jackd_log_offset = 0
+        self.xruns = 0
+
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run_monitor, daemon=True)
+
+    def add_callback(self, cb):
+        self._callbacks.append(cb)
+
+    def add_alert_callback(self, cb):
+        self._alert_callbacks.append(cb)
+
+    def add_cleared_callback(self, cb):
+        self._cleared_callbacks.append(cb)
+
+    def _read_cpu(self):
+        """Percent of CPU time not idle since the previous sample"""
+        fields = [int(v) for v in self._stat.read().split('\n', 1)[0].split()[1:]]
+        idle, total = fields[3] + fields[4], sum(fields)  # idle + iowait
+        previous, self._cpu_times = self._cpu_times, (idle, total)
+        if previous is None or total == previous[1]:
+            return 0.0
+        return 100.0 * (1 - (idle - previous[0]) / (total - previous[1]))
+
+    def _read_memory(self):
+        meminfo = {}
+        for line in self._meminfo.read().splitlines():
+            key, value = line.split(':', 1)
+            meminfo[key] = int(value.split()[0])
+        return 100.0 * (1 - meminfo['MemAvailable'] / meminfo['MemTotal'])
+
+    def _read_temperature(self):
+        value = self._temperature.read()
+        return int(value) / 1000.0 if value else None
+
+    def _read_throttled(self):
+        # Bits 0-3: under-voltage, arm frequency capped, throttled, soft temperature limit (currently active)
+        value = self._throttled.read()
+        return int(value, 16) & 0xf if value else None
+
+    def _read_xruns(self):
+        """Counts new xrun reports in jackd's output since the last sample"""
+        try:
+            with open(self._jackd_log_path, 'rb') as f:
+                f.seek(0, 2)
+                if f.tell() < self._jackd_log_offset:  # jackd restarted and log was truncated
+                    self._jackd_log_offset = 0
+                f.seek(self._jackd_log_offset)
+                data = f.read()
+        except OSError:
+            return 0
+        # Only count complete lines, a partial line is read again next time
+        data = data[:data.rfind(b'\n') + 1]
+        self._jackd_log_offset += len(data)
+        new_xruns = data.lower().count(b'xrun of at least')
+        self.xruns += new_xruns
+        return new_xruns
+
+    def sample(self):
+        new_xruns = self._read_xruns()
+        s = Sample(time.monotonic(), self._read_cpu(), self._read_temperature(), self._read_memory(), self.xruns, self._read_throttled())
+        self.samples.append(s)
+
+        status = self.status()
+        for cb in self._callbacks:
+            cb(s, status)
+
+        self._check_thresholds(s, new_xruns)
+        return s
+
+    def status(self):
+        """Compact one line status of the latest sample"""
+        if not self.samples:
+            return 'n/a'
+        s = self.samples[-1]
+        status = 'CPU {:.0f}% mem {:.0f}% xruns {}'.format(s.cpu, s.memory, s.xruns)
+        if s.temperature is not None:
+            status += ' {:.0f}C'.format(s.temperature)
+        if s.throttled:
+            status += ' THROTTLED'
+        return status
+
+    def _check_thresholds(self, s, new_xruns):
+        exceeded = {
+            'cpu': s.cpu > self._thresholds['cpu'],
+            'temperature': s.temperature is not None and s.temperature > self._thresholds['temperature'],
+            'memory': s.memory > self._thresholds['memory'],
+            'xruns': new_xruns > self._thresholds['xruns'],
+            'throttled': bool(s.throttled),
+        }
+        messages = {
+            'cpu': 'CPU {:.0f}%'.format(s.cpu),
+            'temperature': 'Temp {}C'.format(s.temperature),
+            'memory': 'Memory {:.0f}%'.format(s.memory),
+            'xruns': '{} new xruns'.format(new_xruns),
+            'throttled': 'Throttled 0x{:x}'.format(s.throttled or 0),
+        }
+        for name, active in exceeded.items():
+            if active and name not in self._active_alerts:
+                self._active_alerts[name] = messages[name]
+                self._log.warning('Health alert: %s', messages[name])
+                for cb in self._alert_callbacks:
+                    cb(messages[name])
+            elif not active and name in self._active_alerts:
+                message = self._active_alerts.pop(name)
+                self._log.info('Health alert cleared: %s', name)
+                for cb in self._cleared_callbacks:
+                    cb(message)
+
+    def _run_monitor(self):
+        while not self._stop_event.wait(self._interval):
+            try:
+                self.sample()
+            except Exception:
+                self._log.exception('Health sample failed')
+
+    def start(self):
+        self._read_cpu()  # baseline for the first CPU load
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
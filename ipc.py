@@ -10,6 +10,7 @@ class IpcServer:
         self._socket.bind((self._bind_address, self._port))
         self._socket.listen(3)
         self._thread = threading.Thread(target=self._run_server)
+        self.health_status = None  # callable returning the system health status
 
     def _run_server(self):
         self._running = True
@@ -18,8 +19,12 @@ class IpcServer:
             if not self._running:
                 break
             print('CLIENT SOCKET: {} {}'.format(client, addr))
-            print(client.recv(32))
-            client.send(b'Hi\n')
+            request = client.recv(32)
+            print(request)
+            if request.strip() == b'health' and self.health_status:
+                client.send(self.health_status().encode() + b'\n')
+            else:
+                client.send(b'Hi\n')
 
     def start(self):
         self._thread.start()
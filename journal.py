@@ -0,0 +1,199 @@
+import argparse
+import glob
+import itertools
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+
+
+SOURCE_APP = 0  # event passed to App.send_event: a = event target
+SOURCE_MIDI = 1  # message received by MidiReceiver: a, b, c = channel, cc, value
+
+PAYLOAD_NONE = 0
+PAYLOAD_INT = 1
+PAYLOAD_STR = 2
+PAYLOAD_HITS = 3  # list of (loop, cmd) looper hits: int payload = number of hits, str payload = packed _HIT records
+PAYLOAD_UNSUPPORTED = 4  # payload didn't fit into a record, skipped on replay
+
+# magic, version, record size, capacity, records written (wraps around capacity)
+_HEADER = struct.Struct('<8sIIIQ4x')
+_COUNT = struct.Struct('<Q')
+_COUNT_OFFSET = 20
+# monotonic ns, source, a, b, c, payload kind, int payload, str payload
+_RECORD = struct.Struct('<QBBBBBi31s')  # 48 bytes
+_STR_SIZE = 31
+# loop (-1: all loops), index into _LOOPER_COMMANDS
+_HIT = struct.Struct('<bB')
+_MAGIC = b'PBJRNL\x00\x00'
+_VERSION = 2
+
+# sooperlooper hit commands, the index is stored in the journal so only append to this list
+_LOOPER_COMMANDS = [
+    'record', 'overdub', 'multiply', 'insert', 'replace', 'reverse', 'mute', 'undo', 'redo', 'oneshot', 'trigger',
+    'substitute', 'undo_all', 'redo_all', 'mute_on', 'mute_off', 'solo', 'pause', 'pause_on', 'pause_off',
+    'solo_next', 'solo_prev', 'record_solo', 'record_solo_next', 'record_solo_prev', 'set_sync_pos', 'reset_sync_pos',
+]
+_LOOPER_COMMAND_IDS = {cmd: i for i, cmd in enumerate(_LOOPER_COMMANDS)}
+
+Record = namedtuple('Record', ['timestamp', 'source', 'a', 'b', 'c', 'kind', 'payload'])
+
+_log = logging.getLogger(__name__)
+
+
+def _encode_payload(payload):
+    if payload is None:
+        return PAYLOAD_NONE, 0, b''
+    if isinstance(payload, int):
+        return PAYLOAD_INT, payload, b''
+    if isinstance(payload, str):
+        encoded = payload.encode()
+        if len(encoded) <= _STR_SIZE:
+            return PAYLOAD_STR, 0, encoded
+    elif len(payload) * _HIT.size <= _STR_SIZE and all(-1 <= loop < 128 and cmd in _LOOPER_COMMAND_IDS for loop, cmd in payload):
+        return PAYLOAD_HITS, len(payload), b''.join(_HIT.pack(loop, _LOOPER_COMMAND_IDS[cmd]) for loop, cmd in payload)
+
+    _log.warning('Payload %r does not fit into a journal record', payload)
+    return PAYLOAD_UNSUPPORTED, 0, b''
+
+
+def _decode_payload(kind, ival, sval):
+    if kind == PAYLOAD_INT:
+        return ival
+    if kind == PAYLOAD_STR:
+        return sval.rstrip(b'\x00').decode(errors='replace')
+    if kind == PAYLOAD_HITS:
+        return [(loop, _LOOPER_COMMANDS[cmd]) for loop, cmd in (_HIT.unpack_from(sval, i * _HIT.size) for i in range(ival))]
+    return None
+
+
+class EventJournal:
+    """
+    Records app and MIDI events into a preallocated, memory-mapped file of fixed-width records.
+
+    Appending is a single struct.pack_into on the mapping (no allocation, no syscall), so it
+    can be called from the MIDI callback. When the file is full the oldest records are
+    overwritten. Payloads which don't fit (strings over 31 bytes, more than 15 looper hits)
+    are recorded as PAYLOAD_UNSUPPORTED and skipped on replay.
+    """
+    def __init__(self, path, capacity=65536):
+        self._log = logging.getLogger(__name__)
+        self._capacity = capacity
+        self._counter = itertools.count()
+        self._count_lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'w+b')
+        self._file.truncate(_HEADER.size + capacity * _RECORD.size)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        _HEADER.pack_into(self._mmap, 0, _MAGIC, _VERSION, _RECORD.size, capacity, 0)
+        self._log.info('Recording events to {} ({} records)'.format(path, capacity))
+
+    def _append(self, source, a, b, c, payload):
+        kind, ival, sval = _encode_payload(payload)
+        # itertools.count is atomic under the GIL so concurrent writers get distinct slots
+        i = next(self._counter)
+        offset = _HEADER.size + (i % self._capacity) * _RECORD.size
+        _RECORD.pack_into(self._mmap, offset, time.monotonic_ns(), source, a, b, c, kind, ival, sval)
+        # Writers can finish out of order, a slower one mustn't lower the count
+        with self._count_lock:
+            if i + 1 > _COUNT.unpack_from(self._mmap, _COUNT_OFFSET)[0]:
+                _COUNT.pack_into(self._mmap, _COUNT_OFFSET, i + 1)
+
+    def record_event(self, event_target, event_payload):
+        self._append(SOURCE_APP, event_target, 0, 0, event_payload)
+
+    def record_midi(self, channel, cc, value):
+        self._append(SOURCE_MIDI, channel, cc, value, None)
+
+    def close(self):
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.close()
+
+
+def read_journal(path):
+    """Returns the records of a journal file, oldest first (slots not written yet are skipped)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    magic, version, record_size, capacity, count = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or version != _VERSION or record_size != _RECORD.size:
+        raise ValueError('{} is not a version {} event journal'.format(path, _VERSION))
+
+    records = []
+    for i in range(max(0, count - capacity), count):
+        timestamp, source, a, b, c, kind, ival, sval = _RECORD.unpack_from(data, _HEADER.size + (i % capacity) * record_size)
+        if timestamp == 0:  # counted by a faster writer while this one was still writing
+            continue
+        records.append(Record(timestamp, source, a, b, c, kind, _decode_payload(kind, ival, sval)))
+    return records
+
+
+def prune_journals(directory, keep, exclude=()):
+    """Deletes all but the newest keep journal-*.bin files (named by start time) in directory"""
+    exclude = {os.path.abspath(p) for p in exclude}
+    paths = sorted(p for p in glob.glob(os.path.join(directory, 'journal-*.bin')) if os.path.abspath(p) not in exclude)
+    for path in paths[:max(0, len(paths) - keep)]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            _log.warning('Could not delete old journal {}: {}'.format(path, e))
+
+
+class JournalReplay:
+    """
+    Feeds the app events of a journal back into App.send_event.
+
+    speed scales the original timing (2.0 plays twice as fast), speed 0 replays as fast
+    as possible which is useful as a regression benchmark.
+    """
+    def __init__(self, app, path, speed=1.0):
+        self._log = logging.getLogger(__name__)
+        self._app = app
+        self._records = [r for r in read_journal(path) if r.source == SOURCE_APP and r.kind != PAYLOAD_UNSUPPORTED]
+        self._speed = speed
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        self._log.info('Replaying {} events at speed {}'.format(len(self._records), self._speed or 'max'))
+        start = time.monotonic()
+        first = self._records[0].timestamp if self._records else 0
+        for record in self._records:
+            if self._speed:
+                delay = (record.timestamp - first) / 1e9 / self._speed - (time.monotonic() - start)
+                if delay > 0 and self._stop_event.wait(delay):
+                    break
+            if self._stop_event.is_set():
+                break
+            self._app.send_event(record.a, record.payload)
+        elapsed = time.monotonic() - start
+        self._log.info('Replay finished: {} events in {:.3f}s'.format(len(self._records), elapsed))
+        return elapsed
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the records of an event journal')
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    records = read_journal(args.path)
+    start = records[0].timestamp if records else 0
+    for r in records:
+        if r.source == SOURCE_MIDI:
+            print('{:10.3f} midi  ch={} cc={} value={}'.format((r.timestamp - start) / 1e9, r.a, r.b, r.c))
+        else:
+            payload = '<unsupported>' if r.kind == PAYLOAD_UNSUPPORTED else repr(r.payload)
+            print('{:10.3f} event target={} payload={}'.format((r.timestamp - start) / 1e9, r.a, payload))
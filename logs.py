@@ -0,0 +1,56 @@
+import atexit
+import collections
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+
+class _LazyQueueHandler(QueueHandler):
+    """
+    Passes records to the queue unformatted.
+
+    QueueHandler.prepare() formats the message in the calling thread, which is exactly
+    what should stay out of the MIDI callback. Records never leave the process so the
+    listener thread can format them.
+    """
+    def prepare(self, record):
+        return record
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the most recent records in memory, formatted only when they are looked at"""
+    def __init__(self, capacity=500):
+        super().__init__()
+        self._records = collections.deque(maxlen=capacity)
+
+    def emit(self, record):
+        self._records.append(record)
+
+    def messages(self):
+        """Formatted messages, newest first"""
+        with self.lock:
+            records = list(self._records)
+        return [self.format(r) for r in reversed(records)]
+
+
+def setup_logging(level, capacity=500):
+    """
+    Routes all logging through a queue to a background thread which writes to the
+    console and a RingBufferHandler. Returns the ring buffer.
+    """
+    log_queue = queue.SimpleQueue()
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    ring_buffer = RingBufferHandler(capacity)
+    ring_buffer.setFormatter(logging.Formatter('%(asctime)s %(levelname).1s %(name)s: %(message)s', datefmt='%H:%M:%S'))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(_LazyQueueHandler(log_queue))
+
+    listener = QueueListener(log_queue, console, ring_buffer)
+    listener.start()
+    atexit.register(listener.stop)  # flush remaining records on exit
+
+    return ring_buffer
@@ -0,0 +1,222 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class LoopClock:
+    """
+    Follows sooperlooper's loop position and extrapolates it between updates.
+
+    sooperlooper reports loop_pos, loop_len and cycle_len in seconds. Between two
+    updates the position advances in real time (wrapping at loop_len). A loop_pos that
+    didn't move since the previous update means the loop is paused (or stopped), then
+    the clock is not running.
+    """
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self.loop_len = 0.0
+        self.cycle_len = 0.0
+        self._pos = 0.0
+        self._pos_time = None
+        self._moving = False
+
+    @property
+    def running(self):
+        return self._moving and self.loop_len > 0
+
+    def update(self, ctrl, value, now=None):
+        if ctrl == 'loop_pos':
+            self._moving = self._pos_time is not None and value != self._pos
+            self._pos = value
+            self._pos_time = self._clock() if now is None else now
+        elif ctrl == 'loop_len':
+            self.loop_len = value
+        elif ctrl == 'cycle_len':
+            self.cycle_len = value
+
+    def quantum(self, quantize):
+        """Length of the given boundary (loop or cycle/beat) in seconds"""
+        if quantize == QuantizedScheduler.QUANTIZE_CYCLE and self.cycle_len > 0:
+            return self.cycle_len
+        return self.loop_len
+
+    def position(self, t):
+        """Extrapolated loop position at time t"""
+        return (self._pos + t - self._pos_time) % self.loop_len
+
+    def next_boundary(self, t, quantize):
+        q = self.quantum(quantize)
+        return t + q - self.position(t) % q
+
+    def snap(self, t, quantize):
+        """Time of the boundary nearest to t"""
+        q = self.quantum(quantize)
+        offset = self.position(t) % q
+        return t - offset if offset < q / 2 else t + q - offset
+
+
+class QuantizedScheduler:
+    """
+    Executes commands (mute, trigger, preset switches, ...) on the next loop or cycle boundary.
+
+    The boundary is predicted with a LoopClock fed by sooperlooper's auto updates. Pending
+    commands are re-snapped to the nearest boundary when a new update corrects the
+    prediction. Commands are executed right away if no loop is running or it is paused,
+    or if the press came at most late_window seconds after a boundary (a slightly late
+    footswitch press).
+    """
+    QUANTIZE_LOOP = 'loop'
+    QUANTIZE_CYCLE = 'cycle'
+
+    def __init__(self, loop=0, late_window=0.03, clock=time.monotonic):
+        self._log = logging.getLogger(__name__)
+        self._loop = loop
+        self._late_window = late_window
+        self._clock = clock
+        self._loop_clock = LoopClock(clock)
+        self._queue = []  # heap of [due, seq, quantize, fn]
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = threading.Thread(target=self._run_scheduler, daemon=True)
+
+    def subscribe(self, osc_interface, interval=10):
+        """Register for sooperlooper's position updates every interval ms, lengths only when they change"""
+        osc_interface.add_callback(self._osc_cb)
+        for ctrl in ['loop_len', 'cycle_len']:
+            osc_interface.register_update(self._loop, ctrl)
+            osc_interface.get(self._loop, ctrl)  # current value, updates only come on changes
+        osc_interface.register_auto_update(self._loop, 'loop_pos', interval)
+
+    def _osc_cb(self, osc_uri, *args):
+        # /get_response i:loop_index s:ctrl f:value
+        if osc_uri == '/get_response' and len(args) == 3 and args[0] == self._loop:
+            self.update(args[1], args[2])
+
+    def update(self, ctrl, value, now=None):
+        with self._cond:
+            self._loop_clock.update(ctrl, value, now)
+            if ctrl == 'loop_pos' and self._queue:
+                if self._loop_clock.running:
+                    for entry in self._queue:
+                        entry[0] = self._loop_clock.snap(entry[0], entry[2])
+                else:
+                    # Paused: there is no boundary coming, run the pending commands now
+                    for entry in self._queue:
+                        entry[0] = self._clock() if now is None else now
+                heapq.heapify(self._queue)
+                self._cond.notify()
+
+    def schedule(self, fn, quantize=QUANTIZE_LOOP):
+        """Queue fn to run on the next boundary, returns the predicted time"""
+        now = self._clock()
+        with self._cond:
+            lc = self._loop_clock
+            if not lc.running or lc.position(now) % lc.quantum(quantize) < self._late_window:
+                due = now
+            else:
+                due = lc.next_boundary(now, quantize)
+            heapq.heappush(self._queue, [due, next(self._seq), quantize, fn])
+            self._cond.notify()
+        self._log.debug('Scheduled %s in %.3fs', fn, due - now)
+        return due
+
+    def cancel_all(self):
+        with self._cond:
+            self._queue = []
+
+    def _run_scheduler(self):
+        with self._cond:
+            while self._running:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                delay = self._queue[0][0] - self._clock()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                fn = heapq.heappop(self._queue)[3]
+                self._cond.release()
+                try:
+                    fn()
+                except Exception:
+                    self._log.exception('Scheduled command failed')
+                finally:
+                    self._cond.acquire()
+
+    def start(self):
+        self._running = True
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+
+
+def _simulate(loop_len=0.5, update_interval=0.01, max_latency=0.003, commands=100, seed=None):
+    """
+    Measures the scheduling error against a simulated sooperlooper.
+
+    The simulated looper sends loop_pos every update_interval with a random transport
+    latency of up to max_latency. Commands are scheduled at random times and the time they
+    executed is compared to the true loop boundary nearest to it. Commands that ran on the
+    boundary just before the press (the press came within the stale update's latency after
+    it) are counted separately. Timing depends on the wall clock and thread scheduling, so
+    seed only fixes the press times and latencies, not the results.
+    """
+    import random
+    import statistics
+
+    rnd = random.Random(seed)
+    scheduler = QuantizedScheduler(late_window=0)
+    scheduler.update('loop_len', loop_len)
+    start = time.monotonic()
+    done = threading.Event()
+
+    def run_looper():
+        while not done.is_set():
+            pos = (time.monotonic() - start) % loop_len
+            latency = rnd.uniform(0, max_latency)
+            time.sleep(latency)
+            scheduler.update('loop_pos', pos)
+            time.sleep(max(0.0, update_interval - latency))
+
+    looper_thread = threading.Thread(target=run_looper)
+    looper_thread.start()
+    scheduler.start()
+    time.sleep(update_interval * 5)
+
+    errors, before_press = [], 0
+    for _ in range(commands):
+        time.sleep(rnd.uniform(0, loop_len))
+        pressed = time.monotonic()
+        fired_at = []
+        fired = threading.Event()
+        scheduler.schedule(lambda f=fired: (fired_at.append(time.monotonic()), f.set()))
+        if not fired.wait(loop_len * 2):
+            print('Command did not fire')
+            continue
+        n = round((fired_at[0] - start) / loop_len)
+        boundary = start + n * loop_len
+        errors.append(fired_at[0] - boundary)
+        if boundary < pressed:
+            before_press += 1
+
+    done.set()
+    looper_thread.join()
+    scheduler.stop()
+
+    abs_ms = sorted(abs(e) * 1000 for e in errors)
+    print('Simulated looper: loop {:.3f}s, updates every {:.0f}ms, latency up to {:.1f}ms'.format(loop_len, update_interval * 1000, max_latency * 1000))
+    print('Commands: {} ({} fired on the boundary just before the press)'.format(len(errors), before_press))
+    print('Error to nearest boundary (ms): mean {:.2f}, median {:.2f}, p95 {:.2f}, max {:.2f}, mean signed {:+.2f}'.format(
+        statistics.mean(abs_ms), statistics.median(abs_ms), abs_ms[int(len(abs_ms) * 0.95) - 1], abs_ms[-1],
+        statistics.mean(errors) * 1000))
+
+
+if __name__ == '__main__':
+    _simulate()
@@ -2,7 +2,9 @@ import logging
 import subprocess
 import threading
 import time
-from pythonosc import dispatcher, osc_server, udp_client
+from pythonosc import dispatcher, osc_bundle_builder, osc_message_builder, osc_server, udp_client
+
+from connections import ConnectionGraph
 
 
 class LooperOscServer:
@@ -14,19 +16,22 @@ class LooperOscServer:
         for osc_uri in ['/quit', '/ping_response', '/get_response']:
             self._dispatcher.map(osc_uri, self._osc_cb)
         self._port = 9959
-        self._server = osc_server.ThreadingOSCUDPServer(('0.0.0.0', self._port), self._dispatcher)
-        self._thread = threading.Thread(target=self._run_server)
-
-    def _run_server(self):
-        self._thread = threading.Thread(target=self._server.serve_forever)
+        # Blocking: one thread handles the datagrams in order (position updates arrive every few ms)
+        self._server = osc_server.BlockingOSCUDPServer(('0.0.0.0', self._port), self._dispatcher)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._callbacks = []
 
     def start(self):
         self._thread.start()
         self._log.info('LooperOscServer started on port {}'.format(self._port))
-        # TODO: register updates with sooperlooper
+
+    def add_callback(self, cb):
+        """cb(osc_uri, *args) is called for every response or update from sooperlooper"""
+        self._callbacks.append(cb)
 
     def _osc_cb(self, *args):
-        self._log.info("LooperOscServer._osc_cb: " + str(args))
+        for cb in self._callbacks:
+            cb(*args)
 
     @property
     def uri(self):
@@ -44,15 +49,41 @@ class SooperlooperOscInterface:
         # Start OSC server and register for updates from sooperlooper
         self._osc_server.start()
 
-    def register_update(self, loop, ctrl, return_path, auto_update=False):
-        """/sl/0/register_update or /register_update, or ...register_auto_update"""
+    def register_update(self, loop, ctrl, return_path='/get_response', auto_update=False, interval=10):
+        """/sl/0/register_update or /register_update, or ...register_auto_update (every interval ms)"""
         prefix = ''
         if loop is not None or loop == -1:
             prefix += '/sl/{}'.format(loop)
 
-        update_method = 'auto_update' if auto_update else 'update'
+        if auto_update:
+            self._osc_client.send_message(prefix + '/register_auto_update', [ctrl, interval, self._osc_server.uri, return_path])
+        else:
+            self._osc_client.send_message(prefix + '/register_update', [ctrl, self._osc_server.uri, return_path])
+
+    def register_auto_update(self, loop, ctrl, interval=10):
+        """Let sooperlooper send ctrl of the loop every interval ms to /get_response"""
+        self.register_update(loop, ctrl, auto_update=True, interval=interval)
+
+    def add_callback(self, cb):
+        self._osc_server.add_callback(cb)
 
-        self._osc_client.send_message(prefix + '/register_' + update_method, [ctrl, self._osc_server.uri, '/get_response'])
+    def hit(self, loop, cmd):
+        """/sl/0/hit (e.g. 'record'), loop -1 addresses all loops"""
+        self._osc_client.send_message('/sl/{}/hit'.format(loop), cmd)
+
+    def hit_bundle(self, hits):
+        """
+        Sends several (loop, cmd) hits as one OSC bundle.
+
+        sooperlooper receives them in a single datagram so they are handled in the same
+        audio cycle instead of milliseconds apart.
+        """
+        bundle = osc_bundle_builder.OscBundleBuilder(osc_bundle_builder.IMMEDIATELY)
+        for loop, cmd in hits:
+            msg = osc_message_builder.OscMessageBuilder(address='/sl/{}/hit'.format(loop))
+            msg.add_arg(cmd)
+            bundle.add_content(msg.build())
+        self._osc_client.send(bundle.build())
 
     def get(self, loop, ctrl):
         """/sl/0/get (e.g. 'state') or /get (e.g. 'tempo')"""
@@ -81,6 +112,29 @@ class Looper:
         self._sooperlooper_osc = SooperlooperOscInterface(self._sl_config['osc_port'])
         self._sooperlooper_osc.get(0, 'state')
 
+    @property
+    def loops(self):
+        return self._sl_config['loops']
+
+    @loops.setter
+    def loops(self, n):
+        """Number of loops, must be set before start()"""
+        if n < 1:
+            raise ValueError('loops must be at least 1')
+        self._sl_config['loops'] = n
+
+    @property
+    def osc_interface(self):
+        return self._sooperlooper_osc
+
+    def hit(self, loop, cmd):
+        self._log.debug('/sl/%s/hit %s', loop, cmd)
+        self._sooperlooper_osc.hit(loop, cmd)
+
+    def hit_bundle(self, hits):
+        self._log.debug('OSC bundle: %s', hits)
+        self._sooperlooper_osc.hit_bundle(hits)
+
     def _run_sooperlooper(self):
         cmd = [
             'sooperlooper',
@@ -107,19 +161,16 @@ class Looper:
         self._sl_thread.start()
         time.sleep(3)
 
-        # Connect jack ports
-        subprocess.call(['jack_connect', 'system:capture_1', 'sooperlooper:loop0_in_1'])
-        for i in range(1, 3):
-            # Mono output to all available sound card outputs
-            subprocess.call(['jack_connect', 'sooperlooper:common_out_1'.format(i), 'system:playback_{}'.format(i)])
-
-        time.sleep(3)
-
-        # TODO: keep attempting to connect (so that it works if plugged in later)
-        subprocess.call(['aconnect', 'USBMIDI', 'sooperlooper'])
-
         self._log.info('sooperlooper successfully started')
 
+    @property
+    def connection_graph(self):
+        """Audio and MIDI routing for sooperlooper (applied by the ConnectionManager)"""
+        audio = [('system:capture_1', 'sooperlooper:loop{}_in_1'.format(i)) for i in range(self.loops)]
+        # Mono output to all available sound card outputs
+        audio += [('sooperlooper:common_out_1', 'system:playback_{}'.format(i)) for i in range(1, 3)]
+        return ConnectionGraph(audio=audio, midi=[('USBMIDI', 'sooperlooper')])
+
     def stop(self):
         subprocess.call(['killall', 'sooperlooper'])
         self._sl_thread.join()
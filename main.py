@@ -1,11 +1,13 @@
 import logging
 import sys
 from app import App
+from logs import setup_logging
 
 
 verbose = '-v' in sys.argv
-logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO)  # , format='%(asctime) - %(level) - %(message)')
+# Log via a background thread so console output stays out of the MIDI callback
+log_buffer = setup_logging(logging.DEBUG if verbose else logging.INFO)
 
 
 if __name__ == '__main__':
-    App().main()
+    App(log_buffer).main()
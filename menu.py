@@ -7,6 +7,7 @@ class Menu:
     trigger actions such as running a process.
     """
     ui = None
+    current = None  # menu currently shown on the UI
 
     def __init__(self, title, parent=None, auto_entry=True):
         self._log = logging.getLogger(__name__)
@@ -26,7 +27,9 @@ class Menu:
         self._ui_items[name] = (text, cb)
 
     def update_item(self, name, text):
-        self.ui.update_item(name, text)
+        self._ui_items[name] = (text, self._ui_items[name][1])
+        if Menu.current is self:
+            self.ui.update_item(name, text)
 
     def goto(self, obj):
         """Reconstructs the UI with the elements from the given menu object"""
@@ -34,6 +37,7 @@ class Menu:
         obj.make_ui()
 
     def make_ui(self):
+        Menu.current = self
         self.ui.reset()
         for name, item in self._ui_items.items():
             if name.startswith('lbl_'):
@@ -3,22 +3,45 @@ import rtmidi
 import subprocess
 import utility
 
+from connections import ConnectionGraph
+from menu import Menu
+
 from functools import partial
 
 
 class BaseMenuHandler:
     app = None
 
+    def midi_device_changed(self, name, present):
+        """Called when a MIDI device (ALSA client) is plugged in or removed"""
+        pass
+
 
 class _MidiHandlerFunctionality(BaseMenuHandler):
+    _devices = {'looper': 'CH345', 'ctrl': 'USBMIDI'}
+
     def __init__(self, ui):
-        self._midi = {name: rtmidi.RtMidiOut() for name in ['looper', 'ctrl']}
-        loop_port_index = self.get_midi_port_index(self._midi['looper'], 'CH345')
-        ctrl_port_index = self.get_midi_port_index(self._midi['ctrl'], 'USBMIDI')
-        self._midi['looper'].openPort(loop_port_index)
-        self._midi['ctrl'].openPort(ctrl_port_index)
-        assert self._midi['looper'].isPortOpen()
-        assert self._midi['ctrl'].isPortOpen()
+        self._midi = {name: rtmidi.RtMidiOut() for name in self._devices}
+        for port_name in self._midi:
+            self._open_port(port_name)
+
+    def _open_port(self, port_name):
+        port_index = self.get_midi_port_index(self._midi[port_name], self._devices[port_name])
+        if port_index < 0:
+            self._log.warning('MIDI device {} not found, {} port stays closed'.format(self._devices[port_name], port_name))
+            return
+        self._midi[port_name].openPort(port_index)
+        assert self._midi[port_name].isPortOpen()
+
+    def midi_device_changed(self, name, present):
+        for port_name, device in self._devices.items():
+            if device not in name:
+                continue
+            if present and not self._midi[port_name].isPortOpen():
+                self._open_port(port_name)
+            elif not present and self._midi[port_name].isPortOpen():
+                self._midi[port_name].closePort()
+                self._log.info('Closed {} port ({} removed)'.format(port_name, device))
 
     def get_midi_port_index(self, midi_port, name):
         """Search for MIDI device"""
@@ -28,9 +51,12 @@ class _MidiHandlerFunctionality(BaseMenuHandler):
         return -1
 
     def _send_cc(self, port_name, cc, value):
-        self._log.debug('Sending CC ({}, {}, {}) to {}'.format(1, cc, value, port_name))
-        msg = rtmidi.MidiMessage().controllerEvent(1, cc, value)
-        self._midi[port_name].sendMessage(msg)
+        self._log.debug('Sending CC (%d, %d, %d) to %s', 1, cc, value, port_name)
+        self._send_message(port_name, rtmidi.MidiMessage().controllerEvent(1, cc, value))
+
+    def _send_message(self, port_name, msg):
+        if self._midi[port_name].isPortOpen():
+            self._midi[port_name].sendMessage(msg)
 
 
 class MidiExpanderHandler(_MidiHandlerFunctionality):
@@ -79,41 +105,95 @@ class PresetsHandler(_MidiHandlerFunctionality):
             [1, 1, 0, 1],  # all (loop 3 not valid at the moment)
         ]
 
-    def trigger_preset(self, i):
-        self._current_preset = i
+    def preset_messages(self, i):
+        """Builds the (port_name, MidiMessage) list switching to preset i, e.g. to prepare it ahead of time"""
+        ccs = [('looper', 80 + loop_i, loop) for loop_i, loop in enumerate(self._presets[i])]
+        ccs += [('ctrl', 5 + clear_i, 0) for clear_i in range(4)]
+        ccs.append(('ctrl', 5 + i, 1))
+        return [(port_name, rtmidi.MidiMessage().controllerEvent(1, cc, value)) for port_name, cc, value in ccs]
 
-        for loop_i, loop in enumerate(self._presets[self._current_preset]):
-            self._send_cc('looper', 80 + loop_i, loop)
+    def trigger_preset(self, i, messages=None):
+        self._current_preset = i
+        self._log.debug('Switching to preset %d', i)
 
-        for clear_i in range(4):
-            self._send_cc('ctrl', 5 + clear_i, 0)
-        self._send_cc('ctrl', 5 + self._current_preset, 1)
+        for port_name, msg in messages or self.preset_messages(i):
+            self._send_message(port_name, msg)
 
 
 class LooperHandler(BaseMenuHandler):
     """
     Handle events in Looper menu.
 
-    Sends OSC commands to sooperlooper.
+    Sends OSC commands to sooperlooper. With more than one loop every loop gets its
+    own submenu and state, and multi-loop actions are sent as a single OSC bundle.
     """
-    def __init__(self, ui):
+    def __init__(self, ui, looper):
         self._log = logging.getLogger('LooperHandler')
-        self._ui = ui
-        self._program = 'sendosc'
-        self._recording = False
-        ui.add_item('lbl_state', 'Loop state')
-        for item in ['record', 'overdub', 'undo', 'redo', 'mute', 'trigger']:
-            ui.add_item(item, item.capitalize(), partial(self.send_osc, item))
-
-    def send_osc(self, s):
-        cmd = [self._program, '127.0.0.1', '9951', '/sl/0/hit', 's', s]
-        self._log.debug(' '.join(cmd))
-        subprocess.call(cmd)
-
+        self._looper = looper
+        self._loops = [{'recording': False, 'muted': False, 'paused': False} for _ in range(looper.loops)]
+
+        if looper.loops == 1:
+            self._menus = [ui]
+        else:
+            self._menus = [Menu('loop{}'.format(i + 1), ui) for i in range(looper.loops)]
+            ui.add_item('stop-all', 'Stop all', self.stop_all)
+            ui.add_item('play-all', 'Play all', self.play_all)
+
+        for loop, menu in enumerate(self._menus):
+            menu.add_item('lbl_state', 'Loop state')
+            for item in ['record', 'overdub', 'undo', 'redo', 'mute', 'trigger']:
+                menu.add_item(item, item.capitalize(), partial(self.send_osc, item, loop))
+
+    def _valid_loop(self, loop):
+        if loop == -1 or 0 <= loop < len(self._loops):
+            return True
+        self._log.warning('Ignoring command for loop %s, only %d loop(s) configured', loop, len(self._loops))
+        return False
+
+    def send_osc(self, s, loop=0):
+        """Sends a command to one loop (-1 for all loops)"""
+        if not self._valid_loop(loop):
+            return
+        self._looper.hit(loop, s)
+        self._update_state(loop, s)
+
+    def send_bundle(self, hits):
+        """Sends (loop, cmd) pairs, e.g. [(1, 'record'), (0, 'mute')], as one OSC bundle"""
+        hits = [(loop, s) for loop, s in hits if self._valid_loop(loop)]
+        if not hits:
+            return
+        self._looper.hit_bundle(hits)
+        for loop, s in hits:
+            self._update_state(loop, s)
+
+    def stop_all(self):
+        self.send_bundle([(loop, 'pause_on') for loop in range(len(self._loops))])
+
+    def play_all(self):
+        self.send_bundle([(loop, 'pause_off') for loop in range(len(self._loops))])
+
+    def _update_state(self, loop, s):
+        if loop == -1:  # sooperlooper addresses all loops with -1
+            for i in range(len(self._loops)):
+                self._update_state(i, s)
+            return
+
+        state = self._loops[loop]
         if s == 'record':
-            self._recording = not self._recording
-            self._log.info('Recording: {!s}'.format(self._recording))
-            self._ui.update_item('lbl_state', '{}recording'.format('' if self._recording else 'not '))
+            state['recording'] = not state['recording']
+            self._log.info('Loop %d recording: %s', loop, state['recording'])
+        elif s == 'mute':
+            state['muted'] = not state['muted']
+        elif s in ('mute_on', 'mute_off'):
+            state['muted'] = s == 'mute_on'
+        elif s in ('pause_on', 'pause_off'):
+            state['paused'] = s == 'pause_on'
+        else:
+            return
+
+        text = '{}recording'.format('' if state['recording'] else 'not ')
+        text += ''.join(', ' + flag for flag in ['muted', 'paused'] if state[flag])
+        self._menus[loop].update_item('lbl_state', text)
 
 
 class RecordHandler(BaseMenuHandler):
@@ -159,43 +239,118 @@ class DrumsHandler(BaseMenuHandler):
         self._drum_sequencer.stop()
 
 
+class SetlistHandler(BaseMenuHandler):
+    """
+    Handle events in Setlist menu.
+
+    Steps through the songs of a Setlist, a single footswitch event advances to the next song.
+    """
+    def __init__(self, ui, setlist):
+        self._ui = ui
+        self._setlist = setlist
+        ui.add_item('lbl_song', 'No song')
+        ui.add_item('next', 'Next', self.next_song)
+        for i, song in enumerate(setlist.songs):
+            ui.add_item('song{}'.format(i), song.title, partial(self.goto_song, i))
+
+    def next_song(self):
+        self._setlist.next()
+        self._update_label()
+
+    def goto_song(self, i):
+        self._setlist.goto(i)
+        self._update_label()
+
+    def _update_label(self):
+        song = self._setlist.current
+        if song:
+            self._ui.update_item('lbl_song', '{}/{} {}'.format(self._setlist.index + 1, len(self._setlist.songs), song.title))
+
+
 class UtilitiesHandler(BaseMenuHandler):
     """
     Handle events in Utilities menu.
 
     Various settings and utilities like setting up audio or MIDI connections.
     """
-    def __init__(self, ui):
+    LOG_LINES_PER_PAGE = 6
+    LOG_LINE_LENGTH = 60
+
+    def __init__(self, ui, log_buffer=None):
         self._log = logging.getLogger('UtilitiesHandler')
         self._ui = ui
         ui.add_item('midi-passthru', 'Midi thru', self.midi_passthru)
         ui.add_item('audio-passthru', 'Audio thru', self.audio_passthru)
         ui.add_item('flush-midi', 'Disconnect', self.flush_midi)
-        ui.add_item('show-mapping', 'Mapping', self.show_midi_mapping)
-        ui.add_item('lbl_mapping', 'n/a')
+
+        self._log_buffer = log_buffer
+        if log_buffer:
+            # Log viewer: pages through the most recent log messages, newest first
+            self._log_menu = Menu('log', ui, auto_entry=False)
+            self._log_menu.add_item('back', 'Back', lambda: self._log_menu.goto(ui))
+            self._log_menu.add_item('lbl_log', '')
+            self._log_menu.add_item('older', 'Older', partial(self.page_log, 1))
+            self._log_menu.add_item('newer', 'Newer', partial(self.page_log, -1))
+            ui.add_item('log', 'Log', self.show_log)
+
+    def show_log(self):
+        self._log_page = 0
+        self._messages = self._log_buffer.messages()
+        self._update_log_page()
+        self._ui.goto(self._log_menu)
+
+    def page_log(self, direction):
+        if direction < 0 and self._log_page == 0:
+            # Already on the newest page: fetch the latest messages instead
+            self._messages = self._log_buffer.messages()
+        pages = max(1, -(-len(self._messages) // self.LOG_LINES_PER_PAGE))
+        self._log_page = min(max(self._log_page + direction, 0), pages - 1)
+        self._update_log_page()
+
+    def _update_log_page(self):
+        start = self._log_page * self.LOG_LINES_PER_PAGE
+        lines = [(m.splitlines() or [''])[0][:self.LOG_LINE_LENGTH] for m in self._messages[start:start + self.LOG_LINES_PER_PAGE]]
+        self._log_menu.update_item('lbl_log', '\n'.join(lines) or 'No log messages')
 
     def midi_passthru(self):
-        self._log.debug(subprocess.check_output(['aconnect', '-i', '-o']))
-        self._log.debug(subprocess.check_output(['aconnect', '-l']))
+        """Toggles routing the foot controller straight to the CH345 adapter"""
+        connections = self.app.connections
+        if connections.has_graph('midi-passthru'):
+            connections.set_graph('midi-passthru', None)
+            if self.app.midi_receiver:
+                self.app.midi_receiver.enabled = True
+                self._log.info('MidiReceiver enabled')
+            return
+
         assert utility.check_midi(['USBMIDI', 'CH345']), 'USBMIDI or CH345 adapter missing'
-        subprocess.check_call(['aconnect', 'USBMIDI', 'CH345'])
+        connections.set_graph('midi-passthru', ConnectionGraph(midi=[('USBMIDI', 'CH345')]))
         self._log.info('Connected USBMIDI:0 to CH345:0')
-        self.app.midi_receiver.enable = False  # disable while passthru is active
-        self._log.info('MidiReceiver disabled')
+        if self.app.midi_receiver:
+            self.app.midi_receiver.enabled = False  # disable while passthru is active
+            self._log.info('MidiReceiver disabled')
 
     def audio_passthru(self):
-        self._log.debug(subprocess.check_output(['jack_lsp', '-c']))
-        subprocess.check_call(['jack_connect', 'system:capture_1', 'system:playback_1'])
-        self._log.info('Connected system:capture to system:playback')
+        """Toggles routing the sound card input straight to its output"""
+        connections = self.app.connections
+        if connections.has_graph('audio-passthru'):
+            connections.set_graph('audio-passthru', None)
+            self._log.info('Disconnected system:capture from system:playback')
+        else:
+            connections.set_graph('audio-passthru', ConnectionGraph(audio=[('system:capture_1', 'system:playback_1')]))
+            self._log.info('Connected system:capture to system:playback')
 
     def flush_midi(self):
-        self._log.debug(subprocess.check_output(['aconnect', '-l']))
-        subprocess.check_call(['aconnect', '-x'])
+        """Toggles between disconnecting all MIDI connections and restoring the MIDI routing"""
+        connections = self.app.connections
+        if connections.midi_flushed:
+            connections.restore_midi()
+            self._log.info('MIDI routing restored')
+            return
 
-    def show_midi_mapping(self):
-        mapping = '\n'.join(['test1', 'test2', 'test3'])
-        self._log.info(mapping)
-        self._ui.update_item('lbl_mapping', mapping)
+        connections.flush_midi()  # also ends MIDI passthru
+        if self.app.midi_receiver:
+            self.app.midi_receiver.enabled = True
+        self._log.info('MIDI disconnected')
 
 
 class SystemHandler(BaseMenuHandler):
@@ -205,8 +360,27 @@ class SystemHandler(BaseMenuHandler):
     Controlling services and the Raspberry Pi.
     """
     def __init__(self, ui):
+        self._log = logging.getLogger('SystemHandler')
+        self._ui = ui
         ui.add_item('exit', 'Exit', self.exit_app)
         ui.add_item('poweroff', 'Poweroff', self.poweroff_system)
+        ui.add_item('lbl_health', 'n/a')
+        ui.add_item('lbl_alert', '')
+        self._alerts = []  # active alert messages, oldest first
+
+    def update_health(self, sample, status):
+        self._ui.update_item('lbl_health', status)
+
+    def show_alert(self, message):
+        self._log.warning('Alert: %s', message)
+        if message not in self._alerts:
+            self._alerts.append(message)
+        self._ui.update_item('lbl_alert', ', '.join(self._alerts))
+
+    def clear_alert(self, message):
+        if message in self._alerts:
+            self._alerts.remove(message)
+            self._ui.update_item('lbl_alert', ', '.join(self._alerts))
 
     def exit_app(self):
         self.app.quit()
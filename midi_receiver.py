@@ -8,6 +8,8 @@ class MidiMapping:
     EVENT_TARGET_LOOPER = 2
     EVENT_TARGET_RECORDER = 3
     EVENT_TARGET_DRUMS = 4
+    EVENT_TARGET_ALERT = 5
+    EVENT_TARGET_SETLIST = 6
 
     def __init__(self, channel, cc, event_target, payload):
         if event_target not in [
@@ -15,7 +17,9 @@ class MidiMapping:
             self.EVENT_TARGET_DRUMS,
             self.EVENT_TARGET_LOOPER,
             self.EVENT_TARGET_PRESET,
-            self.EVENT_TARGET_RECORDER
+            self.EVENT_TARGET_RECORDER,
+            self.EVENT_TARGET_ALERT,
+            self.EVENT_TARGET_SETLIST
         ]:
             raise ValueError('event_target must be one of MidiMapping.EVENT_TARGET_...')
 
@@ -61,22 +65,36 @@ class MidiReceiver:
         self._log.info("MidiOut connecting to {}".format(port))
         self._midi_out.openPort(port)
 
-    def _midi_message_cb(self, msg):
-        if not self.enabled:
-            return
+    def close(self):
+        """Stops receiving and releases the MIDI ports (e.g. when the device was unplugged)"""
+        self.enabled = False
+        self._midi_in.cancelCallback()
+        self._midi_in.closePort()
+        self._midi_out.closePort()
+        self._log.info('MIDI ports closed')
 
+    def _midi_message_cb(self, msg):
         ch = msg.getChannel()
         cc = msg.getControllerNumber()
 
-        self._log.debug('Received MIDI message: {} {}'.format(ch, cc))
+        journal = self._app.journal  # read once, App.quit() may detach it concurrently
+        if journal:
+            journal.record_midi(ch, cc, msg.getControllerValue())
+
+        if not self.enabled:
+            return
+
+        self._log.debug('Received MIDI message: %d %d', ch, cc)
 
         # Mapping (channel, cc, value) to event
         self._mapping = [
             # single click
             MidiMapping(channel=2, cc=10, event_target=MidiMapping.EVENT_TARGET_MIDI_LOOP, payload=1),  # toggle loop 1
             # MidiMapping(channel=2, cc=11, event_target=MidiMapping.EVENT_TARGET_DRUMS, payload=1),  # play drums
+            MidiMapping(channel=2, cc=11, event_target=MidiMapping.EVENT_TARGET_SETLIST, payload='next'),  # next song in setlist
             # MidiMapping(channel=2, cc=12, event_target=MidiMapping.EVENT_TARGET_LOOPER, payload='record'),  # record
             # MidiMapping(channel=2, cc=13, event_target=MidiMapping.EVENT_TARGET_LOOPER, payload='stop'),  # stop
+            # MidiMapping(channel=2, cc=13, event_target=MidiMapping.EVENT_TARGET_LOOPER, payload=[(1, 'record'), (0, 'mute')]),  # record loop 2, mute loop 1
             MidiMapping(channel=2, cc=14, event_target=MidiMapping.EVENT_TARGET_PRESET, payload=0),  # switch loops off
             MidiMapping(channel=2, cc=15, event_target=MidiMapping.EVENT_TARGET_PRESET, payload=1),  # switch to preset 1
             MidiMapping(channel=2, cc=16, event_target=MidiMapping.EVENT_TARGET_PRESET, payload=2),  # switch to preset 2
@@ -92,5 +110,5 @@ class MidiReceiver:
 
         m = find_mapping(ch, cc)
         if m:
-            self._log.info('Sending event {}:{}'.format(m.event_target, m.payload))
+            self._log.info('Sending event %s:%s', m.event_target, m.payload)
             self._app.send_event(m.event_target, m.payload)
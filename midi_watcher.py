@@ -0,0 +1,88 @@
+import logging
+import threading
+
+import utility
+
+
+class MidiDeviceWatcher:
+    """
+    Detects MIDI clients (e.g. the USBMIDI foot controller) appearing and disappearing.
+
+    Polls /proc/asound/seq/clients (a plain read, no aconnect fork) and only parses it when
+    its contents changed, so detection latency is bounded by the poll interval. inotify
+    doesn't work here as procfs files never generate modify events.
+
+    Callbacks are called from the watcher thread as cb(client_name, present), changes
+    callbacks once per poll that found any as cb(added, removed) with sets of client names.
+    """
+    def __init__(self, interval=0.25, path=utility.SEQ_CLIENTS_PATH):
+        self._log = logging.getLogger(__name__)
+        self._interval = interval
+        self._path = path
+        self._callbacks = []
+        self._changes_callbacks = []
+        self._contents = None
+        self._clients = set()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run_watcher)
+
+    @property
+    def clients(self):
+        return set(self._clients)
+
+    def add_callback(self, cb):
+        self._callbacks.append(cb)
+
+    def add_changes_callback(self, cb):
+        self._changes_callbacks.append(cb)
+
+    def poll(self):
+        """Checks for added or removed clients and notifies the callbacks"""
+        try:
+            with open(self._path) as f:
+                contents = f.read()
+        except OSError as e:
+            self._log.warning('Could not read {}: {}'.format(self._path, e))
+            return
+
+        if contents == self._contents:
+            return
+        self._contents = contents
+
+        clients = set(utility.parse_seq_clients(contents)[0].values())
+        added, removed = clients - self._clients, self._clients - clients
+        self._clients = clients
+
+        for name in sorted(removed):
+            self._log.info('MIDI device removed: {}'.format(name))
+            self._notify(name, False)
+        for name in sorted(added):
+            self._log.info('MIDI device added: {}'.format(name))
+            self._notify(name, True)
+
+        if added or removed:
+            for cb in self._changes_callbacks:
+                try:
+                    cb(added, removed)
+                except Exception:
+                    self._log.exception('MIDI devices callback failed')
+
+    def _notify(self, name, present):
+        for cb in self._callbacks:
+            try:
+                cb(name, present)
+            except Exception:
+                self._log.exception('MIDI device callback failed for {}'.format(name))
+
+    def _run_watcher(self):
+        while not self._stop_event.wait(self._interval):
+            self.poll()
+
+    def start(self):
+        # Report the clients already present before polling for changes
+        self.poll()
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
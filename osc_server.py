@@ -1,6 +1,6 @@
 import logging
 from threading import Thread
-from pythonosc import dispatcher, osc_server
+from pythonosc import dispatcher, osc_server, udp_client
 
 
 class OscServer:
@@ -9,18 +9,21 @@ class OscServer:
     - /preset i:<N>: loads a preset (switches loops, starts/stops looper, selects drum loops)
     - /loop i:<N>: toggles a loop
     - /sl/<cmd>: passed through to sooperlooper instance
+    - /health i:<port>: replies with the system health status to /health on localhost:<port>
     """
     def __init__(self, use_threading=True):
         self._log = logging.getLogger(__name__)
         self._use_threading = use_threading
         self._port = 5005
         self._dispatcher = dispatcher.Dispatcher()
+        self.health_status = None  # callable returning the system health status
 
         self.register_uri("/ping", self.cb_ping)
         self.register_uri("/quit", self.cb_quit)
         self.register_uri("/preset/*", self.cb_preset)  # preset number (1-4)
         self.register_uri("/sl/*", self.cb_looper)  # looper commands ("undo", "record", etc)
         self.register_uri("/metronome/*", self.cb_metronome)  # Send metronome commands (e.g. a tap (1) or tap tempo value (30-300))
+        self.register_uri("/health", self.cb_health)  # Reply port
 
     def cb_preset(self, *args):
         raise NotImplementedError
@@ -31,6 +34,13 @@ class OscServer:
     def cb_metronome(self, *args):
         raise NotImplementedError
 
+    def cb_health(self, uri, port=None):
+        if not isinstance(port, int) or not 0 < port < 65536:
+            self._log.warning('/health needs the reply port as int argument, got %r', port)
+            return
+        if self.health_status:
+            udp_client.SimpleUDPClient('127.0.0.1', port).send_message('/health', self.health_status())
+
     def register_uri(self, uri, func, *args):
         self._dispatcher.map(uri, func, *args)
 
@@ -51,3 +61,5 @@ class OscServer:
 
     def stop(self):
         self._server.shutdown()
+        if self._use_threading:
+            self._thread.join()
@@ -0,0 +1,82 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+
+# backing_track: index into DrumSequencer.songs (None: no backing track)
+# preset: index into PresetsHandler presets
+# looper: (loop, cmd) hits sent as one bundle when the song starts, e.g. (-1, 'undo_all') clears all loops
+Song = namedtuple('Song', ['title', 'backing_track', 'preset', 'looper'])
+
+SONGS = [
+    Song('Paradise City', backing_track=1, preset=1, looper=[(-1, 'undo_all')]),
+    Song('Pretender', backing_track=2, preset=2, looper=[(-1, 'undo_all')]),
+    Song('Jam', backing_track=None, preset=3, looper=[]),
+]
+
+
+class Setlist:
+    """
+    Steps through an ordered list of songs, each selecting a backing track, preset and looper settings.
+
+    While a song plays the next one is prepared in the background: its backing track is
+    loaded paused into a standby player and its preset MIDI messages are built, so
+    advancing only unpauses the player and sends the prepared messages. Jumping to a
+    song which isn't prepared (yet) starts it from the files instead of waiting.
+    """
+    def __init__(self, songs, drum_sequencer, presets, looper):
+        self._log = logging.getLogger(__name__)
+        self.songs = songs
+        self.index = -1
+        self._drum_sequencer = drum_sequencer
+        self._presets = presets
+        self._looper = looper
+        self._prepared = {}  # song index -> preset messages
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        return self.songs[self.index] if self.index >= 0 else None
+
+    def _prepare(self, i):
+        with self._lock:
+            if i in self._prepared:
+                return
+        song = self.songs[i]
+        if song.backing_track is not None:
+            self._drum_sequencer.prefetch(song.backing_track)
+        messages = self._presets.preset_messages(song.preset)
+        with self._lock:
+            self._prepared = {i: messages}
+
+    def prepare_next(self):
+        """Prefetches the next song in the background"""
+        if self.index + 1 < len(self.songs):
+            threading.Thread(target=self._prepare, args=(self.index + 1,)).start()
+
+    def goto(self, i):
+        t = time.perf_counter()
+        song = self.songs[i]
+        # Never wait for a prefetch: a song which isn't ready yet plays from the SD card
+        with self._lock:
+            preset_messages = self._prepared.get(i)
+
+        if song.backing_track is not None:
+            self._drum_sequencer.selection = song.backing_track
+            self._drum_sequencer.start()
+        else:
+            self._drum_sequencer.stop()
+        self._presets.trigger_preset(song.preset, preset_messages)
+        if song.looper:
+            self._looper.send_bundle(song.looper)
+        self.index = i
+
+        self._log.info('Song {}: {} ({:.1f} ms)'.format(i + 1, song.title, (time.perf_counter() - t) * 1000))
+        self.prepare_next()
+
+    def next(self):
+        if self.index + 1 < len(self.songs):
+            self.goto(self.index + 1)
+        else:
+            self._log.info('End of setlist')
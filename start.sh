@@ -10,8 +10,8 @@ start_jack()
 killall jackd || echo "No jackd running."
 sleep 1
 
-# Start jackd
-start_jack 3 &
+# Start jackd (output is kept in jackd.log, the health monitor counts xruns from it)
+start_jack 3 > jackd.log 2>&1 &
 sleep 1
 
 # Run program
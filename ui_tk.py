@@ -1,3 +1,5 @@
+import queue
+import threading
 from functools import partial
 from tkinter import Tk, Label, Button
 
@@ -58,6 +60,9 @@ class TkUi(UiManager):
 
         self._ui = Tk()
         self._ui.title('UI')
+        # Tk may only be used from the thread that created it, updates from other threads are queued
+        self._thread = threading.current_thread()
+        self._updates = queue.SimpleQueue()
 
         self._button_factory = partial(Button, master=self._ui, font=('Arial', self._fontsize), fg='white', bg='black')
         self._label_factory = partial(Label, master=self._ui, font=('Arial', self._fontsize // 2), fg='black')
@@ -67,8 +72,20 @@ class TkUi(UiManager):
             self._ui.geometry("{}x{}+0+0".format(self._ui.winfo_screenwidth(), self._ui.winfo_screenheight()))
 
     def mainloop(self):
+        self._apply_updates()
         self._ui.mainloop()
 
+    def _apply_updates(self):
+        """Applies label updates queued by other threads, runs every 50 ms in the Tk thread"""
+        while True:
+            try:
+                name, text = self._updates.get_nowait()
+            except queue.Empty:
+                break
+            if name in self._labels:  # the menu may have changed since
+                self._labels[name]['text'] = text
+        self._ui.after(50, self._apply_updates)
+
     def add_button(self, name, text, cb):
         super().add_button(name, text, cb)
         # logging.debug('Tk: adding button at ({:d}, {:d})'.format(self._cur_col, self._cur_row - 1))
@@ -81,4 +98,9 @@ class TkUi(UiManager):
         self._labels[name].grid(column=self._cur_col, row=self._cur_row - 1)
 
     def update_item(self, name, text):
-        self._labels[name]['text'] = text
+        if threading.current_thread() is self._thread:
+            self._labels[name]['text'] = text
+        else:
+            # A Tk call from another thread waits for the mainloop, which hangs if the Tk
+            # thread is blocked on that thread (e.g. App.quit() joining the health monitor)
+            self._updates.put((name, text))
@@ -1,3 +1,4 @@
+import re
 from subprocess import check_output
 
 
@@ -13,9 +14,84 @@ def check_sound_card(expected_dev):
 
 
 def check_midi(list_of_midi_devs):
-    lines = check_output(['aconnect', '-i', '-o']).decode().splitlines()
-    clients = [l for l in lines if l.startswith('client')]
+    clients = read_seq_clients()[0].values()
     for m in list_of_midi_devs:
         if not any(m in c for c in clients):
             return False
     return True
+
+
+SEQ_CLIENTS_PATH = '/proc/asound/seq/clients'
+
+
+def read_seq_clients(path=SEQ_CLIENTS_PATH):
+    """Reads the ALSA sequencer graph without forking aconnect"""
+    with open(path) as f:
+        return parse_seq_clients(f.read())
+
+
+def parse_seq_clients(text):
+    """
+    Parses the contents of /proc/asound/seq/clients.
+
+    Returns ({client_id: client_name}, {'client:port': port_name}, {('client:port', 'client:port'), ...})
+    """
+    clients, ports, edges = {}, {}, set()
+    client = port = None
+    for line in text.splitlines():
+        m = re.match(r'Client\s+(\d+) : "(.*)"', line)
+        if m:
+            client = int(m.group(1))
+            clients[client] = m.group(2)
+            continue
+        m = re.match(r'\s+Port\s+(\d+) : "(.*)"', line)
+        if m:
+            port = '{}:{}'.format(client, m.group(1))
+            ports[port] = m.group(2)
+            continue
+        m = re.match(r'\s+Connecting To: (.*)', line)
+        if m and port is not None:
+            # e.g. "128:0, 129:0[real:0]"
+            edges.update((port, re.match(r'\d+:\d+', dst.strip()).group(0)) for dst in m.group(1).split(','))
+    return clients, ports, edges
+
+
+def parse_jack_lsp(text):
+    """
+    Parses the output of jack_lsp -c -p.
+
+    Returns ({port_name, ...}, {(output_port, input_port), ...}). jack_lsp lists every
+    connection at both ends, only the output -> input direction is kept.
+
+    >>> ports, edges = parse_jack_lsp(
+    ...     'system:capture_1\\n'
+    ...     '   sooperlooper:loop0_in_1\\n'
+    ...     '\\tproperties: output,physical,terminal,\\n'
+    ...     'system:playback_1\\n'
+    ...     '   sooperlooper:common_out_1\\n'
+    ...     '\\tproperties: input,physical,terminal,\\n'
+    ...     'sooperlooper:loop0_in_1\\n'
+    ...     '   system:capture_1\\n'
+    ...     '\\tproperties: input,\\n'
+    ...     'sooperlooper:common_out_1\\n'
+    ...     '   system:playback_1\\n'
+    ...     '\\tproperties: output,\\n')
+    >>> sorted(edges)
+    [('sooperlooper:common_out_1', 'system:playback_1'), ('system:capture_1', 'sooperlooper:loop0_in_1')]
+    >>> len(ports)
+    4
+    """
+    ports, connections, outputs = set(), set(), set()
+    port = None
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            port = line.strip()
+            ports.add(port)
+        elif line.strip().startswith('properties:'):
+            if 'output' in [p.strip() for p in line.split(':', 1)[1].split(',')]:
+                outputs.add(port)
+        else:
+            connections.add((port, line.strip()))
+    return ports, {(src, dst) for src, dst in connections if src in outputs}